@@ -10,11 +10,14 @@ from diffusers.utils import load_image
 from PIL import Image
 import os
 
+from memory_manager import MemoryManager
+
 class DiffusionTransformer:
     """Transforms images using Stable Diffusion models"""
     def __init__(self, model_id="stabilityai/stable-diffusion-xl-base-1.0", 
              device="cuda", prompt="futuristic cybernetic human", 
-             strength=0.75, guidance_scale=7.5):
+             strength=0.75, guidance_scale=7.5, idle_timeout=120,
+             memory_limit_mb=None):
         """
         Initialize the Stable Diffusion pipeline.
         
@@ -24,6 +27,10 @@ class DiffusionTransformer:
             prompt: Default prompt to use for transformation
             strength: How strong the transformation should be (0-1)
             guidance_scale: Guidance scale for diffusion (higher = more prompt adherence)
+            idle_timeout: Seconds without a transformation before the pipeline
+                components are offloaded (None keeps them resident)
+            memory_limit_mb: Memory ceiling for the process; components are
+                unloaded when it is exceeded (None disables the ceiling)
         """
         # Define the exact path to the Hugging Face cache directory
         # This points directly to where your models are already stored
@@ -70,6 +77,8 @@ class DiffusionTransformer:
         
         # Add information about which cache directory we're trying to use
         print(f"Looking for models in: {huggingface_hub_dir}")
+        self.cache_dir = huggingface_hub_dir
+        self.sequential_offload = False
         
         # Initialize the pipeline based on model type (SD or SDXL)
         try:
@@ -118,6 +127,24 @@ class DiffusionTransformer:
         # Move the model to the selected device
         self.pipeline = self.pipeline.to(self.device)
         
+        self._optimize_pipeline()
+
+        # Offload idle components and keep the process under its memory ceiling
+        self.memory_manager = MemoryManager(
+            self.pipeline,
+            device=self.device,
+            dtype=self.dtype,
+            loader=self._load_component,
+            on_reload=self._on_components_reloaded,
+            idle_timeout=idle_timeout,
+            memory_limit_mb=memory_limit_mb,
+            # Sequential offload already keeps weights on the CPU between calls
+            sequential_offload=self.sequential_offload
+        )
+        self.memory_manager.start()
+
+    def _optimize_pipeline(self):
+        """Apply memory optimizations; re-run whenever components are reloaded"""
         # Optimization if on CUDA
         if self.device == "cuda":
             self.pipeline.enable_attention_slicing()
@@ -133,9 +160,31 @@ class DiffusionTransformer:
                 # Try alternative memory optimization
                 try:
                     self.pipeline.enable_sequential_cpu_offload()
+                    self.sequential_offload = True
                     print("Enabled sequential CPU offload")
                 except:
                     pass
+
+    def _on_components_reloaded(self):
+        """Follow the memory manager back to its device and restore optimizations"""
+        self.device = self.memory_manager.device
+        self.dtype = self.memory_manager.dtype
+        self._optimize_pipeline()
+
+    def _load_component(self, name, component_cls):
+        """Load a single pipeline component (e.g. "unet") from the model files"""
+        kwargs = dict(
+            subfolder=name,
+            torch_dtype=self.memory_manager.home_dtype,
+            use_safetensors=True,
+            variant="fp16" if self.memory_manager.home_device == "cuda" else None
+        )
+        try:
+            return component_cls.from_pretrained(
+                self.model_id, local_files_only=True, cache_dir=self.cache_dir, **kwargs)
+        except Exception as e:
+            print(f"Error loading {name} from local cache: {e}")
+            return component_cls.from_pretrained(self.model_id, local_files_only=False, **kwargs)
     
     def transform_image(self, image, prompt=None, body_data=None):
         """
@@ -198,40 +247,31 @@ class DiffusionTransformer:
                     elif avg_shoulder_y > 0.6:  # Lower part of the frame
                         prompt += ", sitting or crouching position, full figure"
         
-        # Run the diffusion pipeline
-        with torch.no_grad():
+        # Run the diffusion pipeline, reloading any offloaded components first
+        with torch.no_grad(), self.memory_manager.acquire():
             try:
                 print(f"Running inference with prompt: {prompt}")
                 print(f"Device: {self.device}, Dtype: {self.dtype}")
                 
-                # For SDXL, explicitly handle different config
-                if "xl" in self.model_id.lower():
-                    result = self.pipeline(
-                        prompt=prompt,
-                        image=pil_image,
-                        strength=self.strength,
-                        guidance_scale=self.guidance_scale,
-                        num_inference_steps=steps
-                    ).images[0]
-                else:
-                    # For regular SD
-                    result = self.pipeline(
-                        prompt=prompt,
-                        image=pil_image,
-                        strength=self.strength,
-                        guidance_scale=self.guidance_scale,
-                        num_inference_steps=steps
-                    ).images[0]
+                result = self.pipeline(
+                    prompt=prompt,
+                    image=pil_image,
+                    strength=self.strength,
+                    guidance_scale=self.guidance_scale,
+                    num_inference_steps=steps
+                ).images[0]
                     
             except RuntimeError as e:
                 print(f"Error during inference: {e}")
                 # Fallback to CPU if we encounter CUDA issues
                 if "CUDA" in str(e) and self.device == "cuda":
+                    # The CPU fallback lasts until the pipeline is next offloaded
                     print("Falling back to CPU...")
                     self.pipeline = self.pipeline.to("cpu")
                     self.device = "cpu"
                     self.dtype = torch.float32
                     self.pipeline.to(dtype=torch.float32)
+                    self.memory_manager.set_execution_device(self.device, self.dtype)
                     
                     # Retry inference
                     result = self.pipeline(
@@ -257,13 +297,10 @@ class DiffusionTransformer:
     
     def cleanup_memory(self):
         """Free up memory after transformations"""
-        if self.device == "cuda":
-            # Clear CUDA cache
-            torch.cuda.empty_cache()
-            
-        # Force garbage collection
-        import gc
-        gc.collect()
-
-    # Call this after transformations
-        self.diffusion.cleanup_memory()
\ No newline at end of file
+        # Clears the CUDA cache and forces garbage collection; the memory
+        # ceiling is already enforced when each transformation finishes
+        self.memory_manager.release_cache()
+    
+    def get_memory_stats(self):
+        """Return resident model size, process RSS and reload latency"""
+        return self.memory_manager.get_stats()
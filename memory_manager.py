@@ -0,0 +1,322 @@
+"""
+MemoryManager - Keeps the diffusion pipeline within a memory budget
+"""
+
+import gc
+import itertools
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import torch
+
+# Component states
+RESIDENT = "resident"    # On the execution device, ready for inference
+OFFLOADED = "offloaded"  # Parked in host memory, fast to move back
+UNLOADED = "unloaded"    # Released entirely, reloaded from the model files
+
+_rss_warning_shown = False
+
+
+def get_process_rss():
+    """Return the resident set size of this process in bytes, or None if unknown"""
+    global _rss_warning_shown
+
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().rss
+    except ImportError:
+        pass
+
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    # Peak RSS is the best we can do without psutil or /proc
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+
+    # e.g. Windows without psutil
+    if not _rss_warning_shown:
+        print("Cannot measure process memory (install psutil); "
+              "host memory will not count towards the memory ceiling")
+        _rss_warning_shown = True
+    return None
+
+
+def get_module_size(module):
+    """Return the number of bytes held by a module's parameters and buffers"""
+    # Meta tensors left by sequential offload keep their shape and dtype, so
+    # this still reports the size of the weights held in host memory
+    if module is None:
+        return 0
+    return sum(t.numel() * t.element_size()
+               for t in itertools.chain(module.parameters(), module.buffers()))
+
+
+class MemoryManager:
+    """Offloads idle pipeline components and enforces a memory ceiling"""
+    def __init__(self, pipeline, device, dtype, loader=None, on_reload=None,
+                 idle_timeout=120, memory_limit_mb=None, check_interval=5,
+                 offload_to_cpu=True, sequential_offload=False):
+        """
+        Track the components of a diffusers pipeline.
+
+        Args:
+            pipeline: Diffusers pipeline whose components should be managed
+            device: Device the pipeline runs inference on ("cuda" or "cpu")
+            dtype: Torch dtype the components use on that device
+            loader: Callable (name, component_class) -> module used to reload
+                unloaded components; without it components are only offloaded
+            on_reload: Callable run after components are restored, e.g. to
+                re-apply attention slicing or offload hooks
+            idle_timeout: Seconds without inference before components are
+                offloaded (None disables idle offload)
+            memory_limit_mb: Ceiling for process RSS plus allocated CUDA memory
+                (None disables the ceiling). A ceiling below the pipeline's
+                working size unloads every component after each inference, so
+                every request reloads the models from disk.
+            check_interval: Seconds between checks of the monitor thread
+            offload_to_cpu: Park idle components in host memory instead of
+                unloading them (only meaningful when device is "cuda")
+            sequential_offload: The pipeline uses sequential CPU offload, so
+                its hooks place weights on the device and reloaded components
+                are left on the CPU for on_reload to hook up again
+        """
+        self.pipeline = pipeline
+        self.home_device = device
+        self.home_dtype = dtype
+        self.device = device
+        self.dtype = dtype
+        self.loader = loader
+        self.on_reload = on_reload
+        self.idle_timeout = idle_timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.check_interval = check_interval
+        self.offload_to_cpu = offload_to_cpu and device == "cuda" and not sequential_offload
+        self.sequential_offload = sequential_offload
+
+        # Every model in the pipeline (text encoders, VAE, UNet, safety checker, ...)
+        self.components = [name for name, component in pipeline.components.items()
+                           if isinstance(component, torch.nn.Module)]
+        self.component_classes = {name: type(getattr(pipeline, name))
+                                  for name in self.components}
+        self.component_sizes = {name: get_module_size(getattr(pipeline, name))
+                                for name in self.components}
+        self.component_state = {name: RESIDENT for name in self.components}
+
+        # Held for the whole of an inference, so nothing is moved mid-run
+        self.lock = threading.RLock()
+        self.last_used = time.time()
+        self.limit_exceeded = False  # Still over the ceiling with nothing left to unload
+
+        # For performance tracking
+        self.reload_times = []
+
+        self._stop_event = threading.Event()
+        self._monitor_thread = None
+
+    @property
+    def memory_limit_bytes(self):
+        """Memory ceiling in bytes, or None if unlimited"""
+        if not self.memory_limit_mb:
+            return None
+        return int(self.memory_limit_mb * 1024 * 1024)
+
+    def get_resident_model_size(self):
+        """Bytes of model weights currently on the execution device"""
+        if self.sequential_offload:
+            # Weights stay in host memory and are streamed in layer by layer
+            return 0
+        return sum(self.component_sizes[name] for name in self.components
+                   if self.component_state[name] == RESIDENT)
+
+    def get_host_model_size(self):
+        """Bytes of model weights currently held in host memory"""
+        return sum(self.component_sizes[name] for name in self.components
+                   if self.component_state[name] == OFFLOADED or
+                   (self.sequential_offload and self.component_state[name] == RESIDENT))
+
+    def get_memory_usage(self):
+        """Bytes counted against the ceiling: process RSS plus CUDA allocations"""
+        usage = get_process_rss() or 0
+        if torch.cuda.is_available():
+            usage += torch.cuda.memory_allocated()
+        return usage
+
+    def get_average_reload_time(self):
+        """Get the average component reload latency in seconds"""
+        if not self.reload_times:
+            return 0
+        return sum(self.reload_times) / len(self.reload_times)
+
+    def get_stats(self):
+        """Return a JSON-serializable snapshot of the memory state"""
+        rss = get_process_rss()
+        return {
+            'device': self.device,
+            'components': dict(self.component_state),
+            'resident_model_mb': self.get_resident_model_size() / 1e6,
+            'host_model_mb': self.get_host_model_size() / 1e6,
+            'process_rss_mb': rss / 1e6 if rss is not None else None,
+            'memory_usage_mb': self.get_memory_usage() / 1e6,
+            'memory_limit_mb': self.memory_limit_mb,
+            'idle_seconds': time.time() - self.last_used,
+            'last_reload_seconds': self.reload_times[-1] if self.reload_times else None,
+            'average_reload_seconds': self.get_average_reload_time(),
+        }
+
+    @contextmanager
+    def acquire(self):
+        """Make sure all components are resident for the duration of an inference"""
+        with self.lock:
+            try:
+                self.ensure_loaded()
+                yield self.pipeline
+            finally:
+                self.last_used = time.time()
+            self.enforce_limit()
+
+    def ensure_loaded(self):
+        """Restore offloaded or unloaded components onto the execution device"""
+        with self.lock:
+            pending = [name for name in self.components
+                       if self.component_state[name] != RESIDENT]
+            if not pending:
+                return
+
+            start_time = time.time()
+            for name in pending:
+                if self.component_state[name] == UNLOADED:
+                    module = self.loader(name, self.component_classes[name])
+                    setattr(self.pipeline, name, module)
+                module = getattr(self.pipeline, name)
+                if not self.sequential_offload:
+                    module.to(self.device, dtype=self.dtype)
+                # Measured before on_reload, while the weights are still real tensors
+                self.component_sizes[name] = get_module_size(module)
+                self.component_state[name] = RESIDENT
+
+            if self.on_reload is not None:
+                self.on_reload()
+
+            # Track performance
+            elapsed = time.time() - start_time
+            self.reload_times.append(elapsed)
+            if len(self.reload_times) > 100:
+                self.reload_times.pop(0)
+            print(f"Reloaded {', '.join(pending)} in {elapsed:.2f}s")
+
+    def offload(self, name):
+        """Move a component to host memory"""
+        module = getattr(self.pipeline, name)
+        module.to("cpu")
+        self.component_state[name] = OFFLOADED
+
+    def unload(self, name):
+        """Release a component entirely; it is reloaded from the model files on demand"""
+        if self.loader is None:
+            # Nothing to reload from, so parking in host memory is the most we can do
+            if self.component_state[name] == RESIDENT:
+                self.offload(name)
+            return False
+        setattr(self.pipeline, name, None)
+        self.component_state[name] = UNLOADED
+        return True
+
+    def offload_idle(self):
+        """Offload (or unload) every resident component after the idle timeout"""
+        with self.lock:
+            resident = [name for name in self.components
+                        if self.component_state[name] == RESIDENT]
+            if not resident:
+                return
+            # A request may have finished while we waited for the lock
+            if time.time() - self.last_used < self.idle_timeout:
+                return
+
+            for name in resident:
+                if self.offload_to_cpu:
+                    self.offload(name)
+                else:
+                    self.unload(name)
+
+            # A CPU fallback only lasts until the pipeline goes idle
+            self.device = self.home_device
+            self.dtype = self.home_dtype
+
+            self.release_cache()
+            print(f"Pipeline idle for {self.idle_timeout}s, released {', '.join(resident)}")
+
+    def enforce_limit(self):
+        """Unload components, largest first, until usage is under the ceiling"""
+        limit = self.memory_limit_bytes
+        if limit is None:
+            return
+
+        with self.lock:
+            # Components parked in host memory go before ones ready for inference
+            candidates = sorted(
+                (name for name in self.components
+                 if self.component_state[name] != UNLOADED),
+                key=lambda name: (self.component_state[name] == RESIDENT,
+                                  -self.component_sizes[name]))
+
+            for name in candidates:
+                if self.get_memory_usage() <= limit:
+                    break
+                if self.unload(name):
+                    print(f"Memory above {self.memory_limit_mb} MB, unloaded {name}")
+                self.release_cache()
+
+            # Only report the change of state, not every check of the monitor thread
+            exceeded = self.get_memory_usage() > limit
+            if exceeded and not self.limit_exceeded:
+                print(f"Memory still above {self.memory_limit_mb} MB after unloading the pipeline")
+            self.limit_exceeded = exceeded
+
+    def set_execution_device(self, device, dtype):
+        """Record that the pipeline was moved, e.g. by the CPU fallback"""
+        with self.lock:
+            self.device = device
+            self.dtype = dtype
+            for name in self.components:
+                if self.component_state[name] == RESIDENT:
+                    self.component_sizes[name] = get_module_size(getattr(self.pipeline, name))
+
+    def release_cache(self):
+        """Free cached allocator blocks and run the garbage collector"""
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def start(self):
+        """Start the background thread that handles idle offload and the ceiling"""
+        if self._monitor_thread is not None and self._monitor_thread.is_alive():
+            return  # Thread is already running
+
+        self._stop_event.clear()
+
+        def monitor_loop():
+            while not self._stop_event.wait(self.check_interval):
+                idle_time = time.time() - self.last_used
+                if self.idle_timeout is not None and idle_time >= self.idle_timeout:
+                    self.offload_idle()
+                self.enforce_limit()
+
+        self._monitor_thread = threading.Thread(target=monitor_loop)
+        self._monitor_thread.daemon = True
+        self._monitor_thread.start()
+
+    def stop(self):
+        """Stop the background monitor thread"""
+        self._stop_event.set()
@@ -4,6 +4,7 @@ Handles Stable Diffusion image generation and WebSocket communication
 """
 
 import os
+import math
 import time
 import base64
 import json
@@ -19,6 +20,7 @@ from io import BytesIO
 # Import your existing components
 from body_tracker import BodyTracker
 from diffusion_transformer import DiffusionTransformer
+from session_recorder import SessionRecorder
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 app.config['SECRET_KEY'] = 'prisma-secret-key'
@@ -33,6 +35,16 @@ regeneration_interval = 30  # Seconds between auto-regenerations
 auto_regenerate = True
 transformed_image = None
 regeneration_thread = None
+idle_offload_timeout = 120  # Seconds without a transformation before the pipeline is offloaded
+memory_limit_mb = None  # Memory ceiling for the server process (None = unlimited); keep it above
+                        # the pipeline's working size or every request reloads the models
+recordings_dir = os.path.join(os.path.dirname(__file__), 'recordings')
+recording_max_mb = 256  # Disk budget per recorded session
+recording_max_sessions = 10  # Oldest closed sessions are deleted beyond this
+session_recorders = {}  # Socket id -> SessionRecorder
+min_replay_speed = 0.1  # Slowest allowed replay speed (0 still means as fast as possible)
+active_replays = set()  # Socket ids with a replay in progress
+replay_lock = threading.Lock()
 
 def init_components():
     """Initialize body tracker and diffusion transformer"""
@@ -55,7 +67,9 @@ def init_components():
         device=device,
         prompt=default_prompt,
         strength=0.75,
-        guidance_scale=7.5
+        guidance_scale=7.5,
+        idle_timeout=idle_offload_timeout,
+        memory_limit_mb=memory_limit_mb
     )
     
     print("Components initialized")
@@ -93,8 +107,30 @@ def start_regeneration_thread():
     regeneration_thread.daemon = True
     regeneration_thread.start()
 
-def process_image(image_data, for_regeneration=False):
-    """Process an image frame from the client"""
+def build_tracking_data(body_data):
+    """Convert body tracking results into the JSON payload sent to the client"""
+    tracking_data = {
+        'is_person_detected': body_data.is_person_detected,
+    }
+    
+    # Only include landmarks if person is detected
+    if body_data.is_person_detected and body_data.pose_landmarks is not None:
+        # Convert landmarks to list for JSON serialization
+        landmarks_list = []
+        for i, landmark in enumerate(body_data.pose_landmarks):
+            if landmark and hasattr(landmark, 'visibility') and landmark.visibility > 0.5:
+                landmarks_list.append({
+                    'index': i,
+                    'x': landmark.x,
+                    'y': landmark.y,
+                    'visibility': landmark.visibility
+                })
+        tracking_data['landmarks'] = landmarks_list
+    
+    return tracking_data
+
+def process_image(image_data, for_regeneration=False, sid=None):
+    """Process an image frame from the client (sid is its socket id)"""
     global is_transforming, last_transformation_time, transformed_image
     
     try:
@@ -109,29 +145,18 @@ def process_image(image_data, for_regeneration=False):
         # Extract body mask and pose results
         mask = body_data.get_person_mask()
         is_person_detected = body_data.is_person_detected
-        pose_landmarks = body_data.pose_landmarks
-        
-        # Send tracking data back to client
-        tracking_data = {
-            'is_person_detected': is_person_detected,
-        }
-        
-        # Only include landmarks if person is detected
-        if is_person_detected and pose_landmarks is not None:
-            # Convert landmarks to list for JSON serialization
-            landmarks_list = []
-            for i, landmark in enumerate(pose_landmarks):
-                if landmark and hasattr(landmark, 'visibility') and landmark.visibility > 0.5:
-                    landmarks_list.append({
-                        'index': i,
-                        'x': landmark.x,
-                        'y': landmark.y,
-                        'visibility': landmark.visibility
-                    })
-            tracking_data['landmarks'] = landmarks_list
         
         # Send tracking results
-        socketio.emit('tracking_results', tracking_data)
+        socketio.emit('tracking_results', build_tracking_data(body_data))
+        
+        # Keep the frame's landmarks and mask for the session history
+        recorder = session_recorders.get(sid)
+        if recorder is not None:
+            try:
+                recorder.record(body_data, mask=mask)
+            except Exception as e:
+                # A recording failure must not interrupt live tracking
+                print(f"Error recording frame: {str(e)}")
         
         # Check if we should transform the image
         should_transform = for_regeneration and is_person_detected and not is_transforming
@@ -155,6 +180,9 @@ def process_image(image_data, for_regeneration=False):
                     _, buffer = cv2.imencode('.jpg', result)
                     img_str = base64.b64encode(buffer).decode('utf-8')
                     
+                    # Free cached memory now that the result is out of the pipeline
+                    diffusion.cleanup_memory()
+                    
                     # Update global state
                     transformed_image = result
                     last_transformation_time = time.time()
@@ -238,6 +266,16 @@ def index():
     """Serve the main application page"""
     return render_template('index.html')
 
+@app.route('/memory')
+def memory_stats():
+    """Report the diffusion pipeline's memory usage and reload latency"""
+    return jsonify(diffusion.get_memory_stats())
+
+@app.route('/sessions')
+def list_sessions():
+    """List the recorded sessions available for replay"""
+    return jsonify(SessionRecorder.list_sessions(recordings_dir))
+
 @app.route('/static/<path:path>')
 def serve_static(path):
     """Serve static files"""
@@ -247,23 +285,140 @@ def serve_static(path):
 def handle_connect():
     """Handle client connection"""
     print('Client connected')
-    emit('connected', {'status': 'connected'})
+    
+    # Delete the oldest closed sessions, leaving room for the new one
+    live_sessions = {r.session_id for r in session_recorders.values()}
+    SessionRecorder.prune_sessions(recordings_dir, recording_max_sessions - 1, keep=live_sessions)
+    
+    # Start recording this client's tracking history
+    session_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.sid[:8]}"
+    session_recorders[request.sid] = SessionRecorder(
+        session_id, recordings_dir, max_size_mb=recording_max_mb)
+    
+    emit('connected', {'status': 'connected', 'session_id': session_id})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle client disconnection"""
     print('Client disconnected')
+    
+    # Stops any replay still streaming to this client
+    with replay_lock:
+        active_replays.discard(request.sid)
+    
+    # Recorded files are kept on disk for later replay
+    recorder = session_recorders.pop(request.sid, None)
+    if recorder is not None:
+        recorder.close()
 
 @socketio.on('frame')
 def handle_frame(data):
     """Handle incoming frame from client"""
-    process_image(data['image'])
+    process_image(data['image'], sid=request.sid)
 
 @socketio.on('transform_request')
 def handle_transform_request(data):
     """Handle transformation request from client"""
     # The data contains the image frame to transform
-    process_image(data['image'], for_regeneration=True)
+    process_image(data['image'], for_regeneration=True, sid=request.sid)
+
+@socketio.on('replay_request')
+def handle_replay_request(data):
+    """
+    Stream a window of a recorded session back to the client.
+    
+    data may contain session_id (defaults to the client's own session),
+    start/end in seconds from the session start, and a playback speed
+    (0 streams as fast as possible, otherwise at least min_replay_speed).
+    Each client can run one replay at a time.
+    """
+    data = data or {}
+    
+    # Validate the client-supplied window and speed
+    try:
+        if not isinstance(data, dict):
+            raise TypeError("expected an object")
+        if data.get('session_id') is not None and not isinstance(data['session_id'], str):
+            raise TypeError("session_id must be a string")
+        start = data.get('start')
+        end = data.get('end')
+        start = float(start) if start is not None else None
+        end = float(end) if end is not None else None
+        speed = float(data.get('speed', 1.0))
+        values = [v for v in (start, end, speed) if v is not None]
+        if not all(math.isfinite(v) for v in values):
+            raise ValueError("values must be finite")
+        if speed != 0 and speed < min_replay_speed:
+            raise ValueError(f"speed must be 0 or at least {min_replay_speed}")
+    except (TypeError, ValueError) as e:
+        emit('replay_error', {'error': f"Invalid replay request: {e}"})
+        return
+    
+    live_recorders = {r.session_id: r for r in session_recorders.values()}
+    own_recorder = session_recorders.get(request.sid)
+    session_id = data.get('session_id') or (own_recorder.session_id if own_recorder else None)
+    
+    if session_id in live_recorders:
+        recorder = live_recorders[session_id]
+        owns_recorder = False
+    elif session_id in SessionRecorder.list_sessions(recordings_dir):
+        recorder = SessionRecorder.open(session_id, recordings_dir)
+        owns_recorder = True
+    else:
+        emit('replay_error', {'error': f"Unknown session: {session_id}"})
+        return
+    
+    if recorder.start_time is None:
+        if owns_recorder:
+            recorder.close()
+        emit('replay_finished', {'session_id': session_id, 'frames': 0})
+        return
+    
+    with replay_lock:
+        already_replaying = request.sid in active_replays
+        if not already_replaying:
+            active_replays.add(request.sid)
+    if already_replaying:
+        if owns_recorder:
+            recorder.close()
+        emit('replay_error', {'error': "A replay is already in progress"})
+        return
+    
+    start_time = recorder.start_time + start if start is not None else None
+    end_time = recorder.start_time + end if end is not None else None
+    
+    def replay_loop(sid):
+        frames_sent = 0
+        previous_timestamp = None
+        try:
+            for frame in recorder.iter_frames(start_time, end_time):
+                # Pace frames by their recorded spacing
+                if speed > 0 and previous_timestamp is not None:
+                    socketio.sleep((frame.timestamp - previous_timestamp) / speed)
+                previous_timestamp = frame.timestamp
+                
+                # The client disconnected
+                if sid not in active_replays:
+                    return
+                
+                replay_data = build_tracking_data(frame.to_body_data())
+                replay_data['timestamp'] = frame.timestamp - recorder.start_time
+                if frame.mask is not None:
+                    _, buffer = cv2.imencode('.png', frame.mask)
+                    mask_str = base64.b64encode(buffer).decode('utf-8')
+                    replay_data['mask'] = f"data:image/png;base64,{mask_str}"
+                
+                socketio.emit('replay_frame', replay_data, to=sid)
+                frames_sent += 1
+        finally:
+            with replay_lock:
+                active_replays.discard(sid)
+            if owns_recorder:
+                recorder.close()
+        
+        socketio.emit('replay_finished', {'session_id': session_id, 'frames': frames_sent}, to=sid)
+    
+    socketio.start_background_task(replay_loop, request.sid)
 
 @socketio.on('toggle_auto_regenerate')
 def handle_toggle_auto_regenerate():
@@ -0,0 +1,414 @@
+"""
+SessionRecorder - Records per-frame tracking data to memory-mapped files for replay
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+NUM_LANDMARKS = 33  # MediaPipe Pose landmark count
+
+# Record flags
+FLAG_PERSON_DETECTED = 1
+FLAG_HAS_LANDMARKS = 2
+FLAG_HAS_MASK = 4
+
+
+def make_record_dtype(mask_size):
+    """Build the fixed-size record layout for a given (width, height) mask size"""
+    mask_bytes = (mask_size[0] * mask_size[1] + 7) // 8
+    return np.dtype([
+        ('timestamp', '<f8'),                         # 0 marks an empty slot
+        ('flags', 'u1'),
+        ('landmarks', '<f2', (NUM_LANDMARKS, 4)),     # x, y, z, visibility
+        ('mask', 'u1', (mask_bytes,)),                # Bit-packed binary mask
+    ])
+
+
+class RecordedFrame:
+    """A single frame read back from a recorded session"""
+    def __init__(self, record, mask_size):
+        self.timestamp = float(record['timestamp'])
+        flags = int(record['flags'])
+        self.is_person_detected = bool(flags & FLAG_PERSON_DETECTED)
+        self.landmarks = None
+        self.mask = None
+
+        if flags & FLAG_HAS_LANDMARKS:
+            self.landmarks = record['landmarks'].astype(np.float32)
+        if flags & FLAG_HAS_MASK:
+            w, h = mask_size
+            bits = np.unpackbits(record['mask'])[:w * h]
+            self.mask = bits.reshape(h, w) * 255
+
+    def to_body_data(self, frame_shape=None):
+        """
+        Rebuild a BodyData so recorded frames can go through the live pipeline.
+
+        Args:
+            frame_shape: Shape of the frame to upscale the mask to (keeps the
+                recorded mask size if None)
+
+        Returns:
+            BodyData with pose landmarks and segmentation mask filled in
+        """
+        # Imported here so reading recordings does not require MediaPipe
+        from body_tracker import BodyData
+
+        body_data = BodyData()
+        body_data.is_person_detected = self.is_person_detected
+
+        if self.landmarks is not None:
+            body_data.pose_landmarks = [
+                SimpleNamespace(x=float(x), y=float(y), z=float(z), visibility=float(v))
+                for x, y, z, v in self.landmarks
+            ]
+
+        if self.mask is not None:
+            mask = self.mask
+            if frame_shape is not None:
+                h, w = frame_shape[:2]
+                mask = cv2.resize(mask, (w, h), interpolation=cv2.INTER_LINEAR)
+            body_data.segmentation_mask = mask.astype(np.float32) / 255.0
+
+        return body_data
+
+
+class SessionRecorder:
+    """Appends tracking results to rotating memory-mapped segment files"""
+    def __init__(self, session_id, root_dir="recordings", mask_size=(64, 48),
+                 records_per_segment=1800, max_size_mb=256, index_interval=1.0):
+        """
+        Create a new recording for a session.
+
+        Args:
+            session_id: Name of the session (used as the directory name)
+            root_dir: Directory that holds all recorded sessions
+            mask_size: (width, height) the person mask is downscaled to
+            records_per_segment: Number of frames per segment file; reduced so
+                that at least two segments fit in max_size_mb
+            max_size_mb: Disk budget for the segment files of the session (None
+                for unlimited); the oldest segment is deleted before a new one
+                would exceed it. At least two records are always kept.
+            index_interval: Seconds covered by each entry of the time index
+        """
+        self.session_id = session_id
+        self.session_dir = os.path.join(root_dir, session_id)
+        self.mask_size = tuple(mask_size)
+        self.index_interval = index_interval
+        self.record_dtype = make_record_dtype(self.mask_size)
+
+        record_bytes = self.record_dtype.itemsize
+        if max_size_mb is None:
+            self.max_segments = None
+        else:
+            budget_bytes = int(max_size_mb * 1024 * 1024)
+            # Keep at least two segments so rotation never drops the whole history
+            records_per_segment = max(1, min(records_per_segment, budget_bytes // (2 * record_bytes)))
+            self.max_segments = max(2, budget_bytes // (record_bytes * records_per_segment))
+        self.records_per_segment = records_per_segment
+
+        self.start_time = None
+        self.first_index = 0  # Oldest record still on disk
+        self.next_index = 0   # Index the next record will be written to
+        self.segments = {}    # Segment number -> memmap
+        self.writable = True
+
+        # time_index[i] is the first record at or after
+        # start_time + (time_index_start + i) * index_interval
+        self.time_index = []
+        self.time_index_start = 0
+
+        self.lock = threading.RLock()
+
+    @classmethod
+    def open(cls, session_id, root_dir="recordings"):
+        """Open a previously recorded session for replay"""
+        session_dir = os.path.join(root_dir, session_id)
+        with open(os.path.join(session_dir, "meta.json")) as f:
+            meta = json.load(f)
+
+        recorder = cls(session_id, root_dir,
+                       mask_size=meta['mask_size'],
+                       records_per_segment=meta['records_per_segment'],
+                       max_size_mb=None,
+                       index_interval=meta['index_interval'])
+        recorder.writable = False
+        recorder.start_time = meta['start_time']
+
+        segment_numbers = sorted(
+            int(name[len("segment_"):-len(".bin")])
+            for name in os.listdir(session_dir)
+            if name.startswith("segment_") and name.endswith(".bin"))
+        if not segment_numbers:
+            return recorder
+
+        for number in segment_numbers:
+            recorder.segments[number] = np.memmap(
+                recorder._segment_path(number), dtype=recorder.record_dtype, mode='r',
+                shape=(recorder.records_per_segment,))
+
+        last_segment = recorder.segments[segment_numbers[-1]]
+        recorder.first_index = segment_numbers[0] * recorder.records_per_segment
+        recorder.next_index = (segment_numbers[-1] * recorder.records_per_segment +
+                               int(np.count_nonzero(last_segment['timestamp'])))
+
+        # Rebuild the time index from the recorded timestamps
+        timestamps = np.concatenate([recorder.segments[n]['timestamp'] for n in segment_numbers])
+        timestamps = timestamps[:recorder.next_index - recorder.first_index]
+        if len(timestamps):
+            first_bucket = int((timestamps[0] - recorder.start_time) / recorder.index_interval)
+            last_bucket = int((timestamps[-1] - recorder.start_time) / recorder.index_interval)
+            bucket_starts = (recorder.start_time +
+                             np.arange(first_bucket, last_bucket + 1) * recorder.index_interval)
+            recorder.time_index = (np.searchsorted(timestamps, bucket_starts) +
+                                   recorder.first_index).tolist()
+            recorder.time_index_start = first_bucket
+        return recorder
+
+    @staticmethod
+    def list_sessions(root_dir="recordings"):
+        """Return the ids of all recorded sessions"""
+        if not os.path.isdir(root_dir):
+            return []
+        return sorted(name for name in os.listdir(root_dir)
+                      if os.path.isfile(os.path.join(root_dir, name, "meta.json")))
+
+    @staticmethod
+    def prune_sessions(root_dir="recordings", max_sessions=10, keep=()):
+        """
+        Delete the oldest recorded sessions so at most max_sessions remain.
+
+        Args:
+            root_dir: Directory that holds all recorded sessions
+            max_sessions: Number of sessions to leave on disk
+            keep: Session ids that must not be deleted (e.g. still recording)
+        """
+        def start_time(session_id):
+            try:
+                with open(os.path.join(root_dir, session_id, "meta.json")) as f:
+                    return json.load(f)['start_time']
+            except (OSError, ValueError, KeyError):
+                return 0
+
+        sessions = sorted(SessionRecorder.list_sessions(root_dir), key=start_time)
+        excess = len(sessions) - max_sessions
+        for session_id in sessions:
+            if excess <= 0:
+                break
+            if session_id in keep:
+                continue
+            try:
+                shutil.rmtree(os.path.join(root_dir, session_id))
+                excess -= 1
+            except OSError as e:
+                print(f"Could not delete recorded session {session_id}: {e}")
+
+    def __len__(self):
+        return self.next_index - self.first_index
+
+    @property
+    def end_time(self):
+        """Timestamp of the most recent record, or None if nothing is recorded"""
+        with self.lock:
+            if not len(self):
+                return None
+            return float(self._get_raw(self.next_index - 1)['timestamp'])
+
+    def _segment_path(self, number):
+        return os.path.join(self.session_dir, f"segment_{number:06d}.bin")
+
+    def _write_meta(self):
+        meta = {
+            'session_id': self.session_id,
+            'start_time': self.start_time,
+            'mask_size': list(self.mask_size),
+            'records_per_segment': self.records_per_segment,
+            'index_interval': self.index_interval,
+        }
+        with open(os.path.join(self.session_dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+    def _open_segment(self, number):
+        """Start a new segment file, first deleting the oldest one if over budget"""
+        while self.max_segments is not None and len(self.segments) >= self.max_segments:
+            oldest = min(self.segments)
+            segment = self.segments.pop(oldest)
+            segment.flush()
+            del segment
+            os.remove(self._segment_path(oldest))
+            self.first_index = (oldest + 1) * self.records_per_segment
+
+        # Drop index entries for buckets that were rotated out entirely
+        stale = 0
+        while stale + 1 < len(self.time_index) and self.time_index[stale + 1] <= self.first_index:
+            stale += 1
+        del self.time_index[:stale]
+        self.time_index_start += stale
+
+        self.segments[number] = np.memmap(
+            self._segment_path(number), dtype=self.record_dtype, mode='w+',
+            shape=(self.records_per_segment,))
+
+    def _get_raw(self, index):
+        segment = self.segments[index // self.records_per_segment]
+        return segment[index % self.records_per_segment]
+
+    def record(self, body_data, mask=None, timestamp=None):
+        """
+        Append a frame's tracking results.
+
+        Args:
+            body_data: BodyData returned by BodyTracker.process_frame
+            mask: Binary person mask if already computed (taken from body_data if None)
+            timestamp: Capture time of the frame (defaults to now)
+
+        Returns:
+            Index of the written record
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self.lock:
+            # Checked under the lock: a late frame after close() must not reopen
+            # (and truncate) the current segment
+            if not self.writable:
+                raise ValueError(f"Session {self.session_id} is closed or read-only")
+
+            if self.start_time is None:
+                os.makedirs(self.session_dir, exist_ok=True)
+                self.start_time = timestamp
+                self._write_meta()
+
+            # Keep timestamps monotonic so the time index stays valid
+            last_time = self.end_time
+            if last_time is not None and timestamp < last_time:
+                timestamp = last_time
+
+            index = self.next_index
+            segment_number, offset = divmod(index, self.records_per_segment)
+            if segment_number not in self.segments:
+                if segment_number > 0 and segment_number - 1 in self.segments:
+                    self.segments[segment_number - 1].flush()
+                self._open_segment(segment_number)
+
+            record = self.segments[segment_number][offset]
+            flags = FLAG_PERSON_DETECTED if body_data.is_person_detected else 0
+
+            if body_data.pose_landmarks is not None:
+                flags |= FLAG_HAS_LANDMARKS
+                record['landmarks'] = [
+                    (lm.x, lm.y, lm.z, lm.visibility)
+                    for lm in list(body_data.pose_landmarks)[:NUM_LANDMARKS]
+                ]
+
+            if mask is None:
+                mask = body_data.get_person_mask()
+            if mask is not None:
+                flags |= FLAG_HAS_MASK
+                small_mask = cv2.resize(mask, self.mask_size, interpolation=cv2.INTER_AREA)
+                record['mask'] = np.packbits(small_mask > 127)
+
+            record['flags'] = flags
+            # Written last: a non-zero timestamp marks the record as complete
+            record['timestamp'] = timestamp
+
+            bucket = int((timestamp - self.start_time) / self.index_interval)
+            while self.time_index_start + len(self.time_index) <= bucket:
+                self.time_index.append(index)
+
+            self.next_index += 1
+            return index
+
+    def get_frame(self, index):
+        """Return the RecordedFrame at a record index"""
+        with self.lock:
+            if not self.first_index <= index < self.next_index:
+                raise IndexError(f"Record {index} is not on disk "
+                                 f"(available: {self.first_index}-{self.next_index - 1})")
+            return RecordedFrame(self._get_raw(index).copy(), self.mask_size)
+
+    def find_index(self, timestamp):
+        """
+        Find the record shown at a given time in O(1).
+
+        Args:
+            timestamp: Absolute time (same clock as the recorded timestamps)
+
+        Returns:
+            Index of the last record at or before timestamp (clamped to the
+            records on disk), or None if the session is empty
+        """
+        with self.lock:
+            if not len(self):
+                return None
+
+            bucket = int((timestamp - self.start_time) // self.index_interval)
+            bucket -= self.time_index_start
+            if bucket < 0:
+                return self.first_index
+            if bucket >= len(self.time_index):
+                return self.next_index - 1
+
+            index = max(self.time_index[bucket], self.first_index)
+            index = min(index, self.next_index - 1)
+
+            # Scan within the bucket; bounded by the frame rate
+            if index > self.first_index and self._get_raw(index)['timestamp'] > timestamp:
+                index -= 1
+            while (index + 1 < self.next_index and
+                   self._get_raw(index + 1)['timestamp'] <= timestamp):
+                index += 1
+            return index
+
+    def get_frame_at(self, timestamp):
+        """Return the RecordedFrame shown at a given time, or None if empty"""
+        index = self.find_index(timestamp)
+        return None if index is None else self.get_frame(index)
+
+    def iter_frames(self, start_time=None, end_time=None):
+        """
+        Yield recorded frames in a time window.
+
+        Args:
+            start_time: Absolute start of the window (oldest record if None)
+            end_time: Absolute end of the window, inclusive (latest record at the
+                time of the call if None; frames recorded later are not followed)
+        """
+        with self.lock:
+            if not len(self):
+                return
+            stop_index = self.next_index
+            index = self.first_index
+            if start_time is not None:
+                index = self.find_index(start_time)
+                if self._get_raw(index)['timestamp'] < start_time:
+                    index += 1
+
+        while True:
+            with self.lock:
+                # Records may have been rotated out while we were yielding
+                index = max(index, self.first_index)
+                if index >= stop_index:
+                    return
+                frame = RecordedFrame(self._get_raw(index).copy(), self.mask_size)
+            if end_time is not None and frame.timestamp > end_time:
+                return
+            yield frame
+            index += 1
+
+    def close(self):
+        """Flush and release all segment files; use open() to replay afterwards"""
+        with self.lock:
+            for segment in self.segments.values():
+                if self.writable:
+                    segment.flush()
+            self.segments.clear()
+            self.first_index = self.next_index
+            self.writable = False
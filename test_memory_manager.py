@@ -0,0 +1,131 @@
+"""
+Tests for MemoryManager offload, reload and memory ceiling
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from memory_manager import MemoryManager, OFFLOADED, RESIDENT, UNLOADED, get_module_size
+
+SIZES = {'text_encoder': 8, 'vae': 16, 'unet': 32}
+
+
+class StubPipeline:
+    """Minimal stand-in for a diffusers pipeline"""
+    def __init__(self):
+        for name, size in SIZES.items():
+            setattr(self, name, torch.nn.Linear(size, size))
+        self.feature_extractor = object()  # Not a model, must be ignored
+
+    @property
+    def components(self):
+        names = list(SIZES) + ['feature_extractor']
+        return {name: getattr(self, name) for name in names}
+
+
+def make_manager(**kwargs):
+    reloads = []
+    kwargs.setdefault('device', "cpu")
+    manager = MemoryManager(
+        StubPipeline(),
+        dtype=torch.float32,
+        loader=lambda name, cls: cls(SIZES[name], SIZES[name]),
+        on_reload=lambda: reloads.append(True),
+        idle_timeout=0,
+        **kwargs
+    )
+    return manager, reloads
+
+
+def model_bytes(name):
+    size = SIZES[name]
+    return (size * size + size) * 4
+
+
+def test_tracks_every_model_component():
+    manager, _ = make_manager()
+    assert sorted(manager.components) == sorted(SIZES)
+    assert manager.component_sizes['unet'] == model_bytes('unet')
+
+
+def test_offload_idle_parks_components_in_host_memory():
+    manager, _ = make_manager(device="cuda")
+    manager.offload_idle()
+    assert set(manager.component_state.values()) == {OFFLOADED}
+    assert manager.get_resident_model_size() == 0
+    assert manager.get_host_model_size() == sum(model_bytes(n) for n in SIZES)
+
+
+def test_offload_idle_unloads_without_offload_to_cpu():
+    manager, _ = make_manager(device="cuda", offload_to_cpu=False)
+    manager.offload_idle()
+    assert set(manager.component_state.values()) == {UNLOADED}
+    assert manager.pipeline.unet is None
+
+
+def test_ensure_loaded_reloads_and_records_latency():
+    manager, reloads = make_manager()
+    manager.offload_idle()
+    assert manager.pipeline.vae is None
+
+    with manager.acquire() as pipeline:
+        assert isinstance(pipeline.vae, torch.nn.Linear)
+    assert set(manager.component_state.values()) == {RESIDENT}
+    assert reloads == [True]
+    assert len(manager.reload_times) == 1
+
+    # Nothing to reload the second time
+    with manager.acquire():
+        pass
+    assert reloads == [True]
+    assert len(manager.reload_times) == 1
+
+
+def test_enforce_limit_releases_offloaded_then_largest_resident():
+    manager, _ = make_manager(device="cuda")
+    manager.offload('text_encoder')
+    manager.get_memory_usage = lambda: sum(
+        manager.component_sizes[name] for name in manager.components
+        if manager.component_state[name] != UNLOADED)
+
+    # Room for the VAE only
+    manager.memory_limit_mb = model_bytes('vae') / (1024 * 1024)
+    manager.enforce_limit()
+    assert manager.component_state == {
+        'text_encoder': UNLOADED, 'vae': RESIDENT, 'unet': UNLOADED}
+    assert not manager.limit_exceeded
+
+
+def test_enforce_limit_reports_once_when_still_exceeded(capsys):
+    manager, _ = make_manager()
+    manager.get_memory_usage = lambda: 10 ** 12
+    manager.memory_limit_mb = 1
+
+    for _ in range(3):
+        manager.enforce_limit()
+    assert set(manager.component_state.values()) == {UNLOADED}
+    assert capsys.readouterr().out.count("Memory still above") == 1
+
+    manager.get_memory_usage = lambda: 0
+    manager.enforce_limit()
+    assert not manager.limit_exceeded
+
+
+def test_sizes_with_sequential_offload():
+    manager, _ = make_manager(device="cuda", sequential_offload=True)
+    assert not manager.offload_to_cpu
+    assert manager.get_resident_model_size() == 0
+    assert manager.get_host_model_size() == sum(model_bytes(n) for n in SIZES)
+
+
+def test_sequential_offload_reload_stays_on_cpu():
+    manager, reloads = make_manager(device="cuda", sequential_offload=True)
+    manager.offload_idle()
+    assert set(manager.component_state.values()) == {UNLOADED}
+
+    # Placement is left to the offload hooks applied by on_reload
+    manager.ensure_loaded()
+    assert reloads == [True]
+    assert manager.pipeline.unet.weight.device.type == "cpu"
+    assert manager.component_sizes['unet'] == get_module_size(manager.pipeline.unet)
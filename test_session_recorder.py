@@ -0,0 +1,173 @@
+"""
+Tests for SessionRecorder rotation, time index and replay
+"""
+
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from session_recorder import SessionRecorder, make_record_dtype
+
+RECORD_BYTES = make_record_dtype((64, 48)).itemsize
+START = 1000.0
+
+
+def make_body_data(value=0.5):
+    """Minimal stand-in for BodyData (avoids MediaPipe)"""
+    landmark = SimpleNamespace(x=value, y=0.25, z=0.0, visibility=0.9)
+    return SimpleNamespace(is_person_detected=True, pose_landmarks=[landmark] * 33)
+
+
+def make_mask():
+    mask = np.zeros((480, 640), np.uint8)
+    mask[100:300, 200:400] = 255
+    return mask
+
+
+def budget_mb(segments, records_per_segment):
+    return segments * records_per_segment * RECORD_BYTES / (1024 * 1024)
+
+
+def record_times(recorder, times):
+    for t in times:
+        recorder.record(make_body_data(), mask=make_mask(), timestamp=t)
+
+
+def segment_files(recorder):
+    return [name for name in os.listdir(recorder.session_dir) if name.endswith(".bin")]
+
+
+def test_rotation_advances_first_index(tmp_path):
+    recorder = SessionRecorder("s", str(tmp_path), records_per_segment=4,
+                               max_size_mb=budget_mb(3, 4))
+    assert recorder.max_segments == 3
+
+    record_times(recorder, [START + i * 0.1 for i in range(12)])
+    assert recorder.first_index == 0
+    assert len(segment_files(recorder)) == 3
+
+    record_times(recorder, [START + 1.2])
+    assert recorder.first_index == 4
+    assert len(recorder) == 9
+    assert len(segment_files(recorder)) == 3
+    with pytest.raises(IndexError):
+        recorder.get_frame(3)
+    assert recorder.get_frame(4).timestamp == pytest.approx(START + 0.4)
+
+
+def test_small_budget_shrinks_segments(tmp_path):
+    max_size_mb = budget_mb(1, 3)
+    recorder = SessionRecorder("s", str(tmp_path), records_per_segment=1800,
+                               max_size_mb=max_size_mb)
+    assert recorder.records_per_segment == 1
+    assert recorder.max_segments == 3
+
+    record_times(recorder, [START + i for i in range(10)])
+    disk_bytes = sum(os.path.getsize(os.path.join(recorder.session_dir, name))
+                     for name in segment_files(recorder))
+    assert disk_bytes <= max_size_mb * 1024 * 1024
+
+
+def test_find_index_at_bucket_edges(tmp_path):
+    recorder = SessionRecorder("s", str(tmp_path))
+    record_times(recorder, [START, START + 0.5, START + 1.0, START + 1.5, START + 3.2])
+
+    assert recorder.find_index(START - 5) == 0
+    assert recorder.find_index(START + 0.999) == 1
+    assert recorder.find_index(START + 1.0) == 2
+    assert recorder.find_index(START + 2.5) == 3  # Empty bucket
+    assert recorder.find_index(START + 3.0) == 3
+    assert recorder.find_index(START + 3.2) == 4
+    assert recorder.find_index(START + 100) == 4
+
+
+def test_find_index_after_rotation(tmp_path):
+    recorder = SessionRecorder("s", str(tmp_path), records_per_segment=4,
+                               max_size_mb=budget_mb(2, 4))
+    record_times(recorder, [START + i * 0.5 for i in range(20)])
+
+    assert recorder.first_index == 12
+    # Index entries for rotated-out buckets are dropped
+    assert recorder.time_index_start > 0
+    assert recorder.time_index[0] <= recorder.first_index
+
+    assert recorder.find_index(START) == 12
+    assert recorder.find_index(START + 6.2) == 12
+    assert recorder.find_index(START + 7.0) == 14
+    assert recorder.find_index(START + 9.5) == 19
+
+
+def test_open_rebuilds_partial_segment(tmp_path):
+    recorder = SessionRecorder("s", str(tmp_path), records_per_segment=4,
+                               max_size_mb=budget_mb(2, 4))
+    times = [START + i * 0.3 for i in range(14)]
+    record_times(recorder, times)
+    recorder.close()
+
+    reopened = SessionRecorder.open("s", str(tmp_path))
+    assert reopened.first_index == 8
+    assert reopened.next_index == 14
+    assert reopened.get_frame(13).timestamp == pytest.approx(times[13])
+    assert reopened.get_frame(13).mask.sum() // 255 == 400
+
+    for t in np.arange(START - 1, START + 5, 0.05):
+        expected = max(8, max(i for i, ts in enumerate(times) if ts <= t)) if t >= START else 8
+        assert reopened.find_index(t) == expected
+
+
+def test_iter_frames_stops_at_latest_record(tmp_path):
+    recorder = SessionRecorder("s", str(tmp_path))
+    record_times(recorder, [START, START + 0.1])
+
+    frames = recorder.iter_frames()
+    assert next(frames).timestamp == START
+    assert next(frames).timestamp == START + 0.1
+    record_times(recorder, [START + 0.2])
+    assert list(frames) == []
+
+
+def test_iter_frames_racing_rotation(tmp_path):
+    recorder = SessionRecorder("s", str(tmp_path), records_per_segment=4,
+                               max_size_mb=budget_mb(2, 4))
+    record_times(recorder, [START + i * 0.1 for i in range(8)])
+
+    frames = recorder.iter_frames()
+    assert next(frames).timestamp == START
+
+    # Rotate out the segment the iterator is reading from
+    record_times(recorder, [START + 0.8 + i * 0.1 for i in range(4)])
+    assert recorder.first_index == 4
+
+    remaining = [frame.timestamp for frame in frames]
+    assert remaining == pytest.approx([START + i * 0.1 for i in range(4, 8)])
+
+
+def test_record_after_close_leaves_files_unchanged(tmp_path):
+    recorder = SessionRecorder("s", str(tmp_path))
+    record_times(recorder, [START + i * 0.1 for i in range(5)])
+    recorder.close()
+
+    def read_files():
+        return {name: open(os.path.join(recorder.session_dir, name), "rb").read()
+                for name in segment_files(recorder)}
+
+    before = read_files()
+    with pytest.raises(ValueError):
+        recorder.record(make_body_data(), mask=make_mask(), timestamp=START + 1)
+    assert read_files() == before
+
+    reopened = SessionRecorder.open("s", str(tmp_path))
+    assert len(reopened) == 5
+    assert reopened.get_frame(0).timestamp == START
+
+
+def test_prune_sessions_keeps_newest_and_live(tmp_path):
+    for i, session_id in enumerate(["a", "b", "c", "d"]):
+        recorder = SessionRecorder(session_id, str(tmp_path))
+        record_times(recorder, [START + i])
+        recorder.close()
+
+    SessionRecorder.prune_sessions(str(tmp_path), max_sessions=2, keep={"a"})
+    assert SessionRecorder.list_sessions(str(tmp_path)) == ["a", "d"]